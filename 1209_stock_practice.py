@@ -1,9 +1,12 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 import pytz
 import sys
+import math
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 import altair as alt # <--- 新增: 引入 Altair 以繪製客製化圖表
 
 # <--- 全域設定: 手動翻譯清單 (最強力的備案，優先級最高) --->
@@ -27,6 +30,12 @@ MANUAL_STOCK_NAMES = {
     "006208": "富邦台50", "00713": "元大台灣高息低波", "00939": "統一台灣高息動能"
 }
 
+# <--- 全域設定: 台灣時區 (只建立一次，各函數共用) --->
+TW_TZ = pytz.timezone('Asia/Taipei')
+
+# <--- 全域設定: 星期名稱 (依 datetime.weekday() 的 0~6 排列) --->
+WEEKDAYS = ('週一', '週二', '週三', '週四', '週五', '週六', '週日')
+
 # <--- 模組匯入檢查: 捕捉 twstock 與 lxml 的狀態 --->
 import_error_msg = None
 missing_lxml = False
@@ -52,26 +61,78 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# <--- 快取: Streamlit 每次重新執行都會重跑整支程式，相同查詢直接讀快取以省下網路請求 --->
+def _download(symbols, period=None, start=None, auto_adjust=False):
+    """ 一次下載多檔股票的資料 (有 start 時忽略 period) """
+    return yf.download(list(symbols), period=period, start=start, group_by="ticker", threads=True,
+                       progress=False, auto_adjust=auto_adjust)
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _cached_download(symbols, period="5d"):
+    """ 今日表格用的近期資料 (symbols 需為排序過的 tuple 以便命中快取) """
+    return _download(symbols, period=period)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_panel_download(symbols, start):
+    """ 走勢圖用的長期日線，與單檔歷史資料同樣快取 300 秒 """
+    # 使用還原權值股價 (與 Ticker.history 預設相同)，避免高股息 ETF 在除息日出現假跌幅
+    return _download(symbols, start=start, auto_adjust=True)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_history(symbol, start, end=None, interval='1d'):
+    """ 抓取單一股票的歷史資料 (參數皆為字串，確保可作為快取鍵值) """
+    return yf.Ticker(symbol).history(start=start, end=end, interval=interval)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def resolve_name(code):
+    """ 查詢股票名稱: 手動清單 > twstock > yfinance info (很慢，通常是英文) """
+    if code in MANUAL_STOCK_NAMES:
+        return MANUAL_STOCK_NAMES[code]
+    if twstock and code in twstock.codes:
+        return twstock.codes[code].name
+    try:
+        return yf.Ticker(f"{code}.TW").info.get('longName', code)
+    except Exception:
+        return code
+# <--- 結束 --->
+
+def _frame_for(raw, symbol):
+    """ 從 yf.download 的多股票結果中取出單一股票的資料表 """
+    if raw.empty:
+        return pd.DataFrame()
+    if isinstance(raw.columns, pd.MultiIndex):
+        if symbol not in raw.columns.get_level_values(0):
+            return pd.DataFrame()
+        return raw[symbol].dropna(subset=['Close'])
+    # 舊版 yfinance 只抓一檔時不會產生 MultiIndex 欄位
+    return raw.dropna(subset=['Close'])
+
 def get_stock_data(stock_list):
-    """ 抓取今日數據 (表格用) """
-    data_list = []
+    """ 抓取今日數據 (表格用)，stock_list 需為已去除空白的代號清單 (見主程式 stock_codes) """
+    # 每個欄位各用一個 list 收集，最後一次建立 DataFrame
+    codes_out, names, dates, closes, changes, pcts, vols = [], [], [], [], [], [], []
     valid_tickers = [] 
     
     progress_bar = st.progress(0)
     status_text = st.empty()
+    
+    # 加上 .TW
+    symbols = [f"{code}.TW" for code in stock_list]
     total_stocks = len(stock_list)
     
-    for i, code in enumerate(stock_list):
-        code = code.strip()
-        if not code: continue
-        
-        # 加上 .TW
-        ticker_symbol = f"{code}.TW"
-        status_text.text(f"正在抓取: {code} ...")
-        
+    # 一次請求抓取所有股票，取代逐檔呼叫 history
+    status_text.text(f"正在抓取: {', '.join(stock_list)} ...")
+    try:
+        raw = _cached_download(tuple(sorted(set(symbols))), period="5d")
+    except Exception as e:
+        st.error(f"抓取股價錯誤: {e}")
+        raw = pd.DataFrame()
+    
+    # 每個 widget 更新都是一次瀏覽器往返，最多更新約 20 次即可
+    step = max(1, total_stocks // 20)
+    for i, (code, ticker_symbol) in enumerate(zip(stock_list, symbols)):
         try:
-            stock = yf.Ticker(ticker_symbol)
-            hist = stock.history(period="5d") 
+            hist = _frame_for(raw, ticker_symbol)
             
             if len(hist) > 0:
                 latest = hist.iloc[-1]
@@ -82,27 +143,15 @@ def get_stock_data(stock_list):
                 change = price - prev_close
                 pct_change = (change / prev_close) * 100
                 
-                # <--- 名稱判斷邏輯優化 --->
-                # 1. 先抓 yfinance 的名字 (通常是英文)
-                name = stock.info.get('longName', code) 
+                name = resolve_name(code)
                 
-                # 2. 強制檢查手動清單 (優先級最高，保證熱門股顯示中文)
-                if code in MANUAL_STOCK_NAMES:
-                    name = MANUAL_STOCK_NAMES[code]
-                # 3. 如果手動清單沒有，且 twstock 模組活著，才嘗試用 twstock 查
-                elif twstock and code in twstock.codes:
-                    name = twstock.codes[code].name
-                # <--- 結束 --->
-                
-                data_list.append({
-                    "代號": code,
-                    "名稱": name,
-                    "日期": latest.name.strftime('%Y-%m-%d'),
-                    "收盤價": round(price, 2),
-                    "漲跌": round(change, 2),
-                    "漲跌幅(%)": round(pct_change, 2),
-                    "成交量": int(latest['Volume'])
-                })
+                codes_out.append(code)
+                names.append(name)
+                dates.append(latest.name.strftime('%Y-%m-%d'))
+                closes.append(price)
+                changes.append(change)
+                pcts.append(pct_change)
+                vols.append(int(latest['Volume']))
                 valid_tickers.append((code, ticker_symbol, name))
             else:
                 st.warning(f"找不到 {code} 的資料。")
@@ -110,155 +159,187 @@ def get_stock_data(stock_list):
         except Exception as e:
             st.error(f"抓取 {code} 錯誤: {e}")
             
-        progress_bar.progress((i + 1) / total_stocks)
+        if (i + 1) % step == 0 or i + 1 == total_stocks:
+            progress_bar.progress((i + 1) / total_stocks)
+            status_text.text(f"正在抓取: {code} ({i + 1}/{total_stocks})")
         
     status_text.text("抓取完成！")
-    return pd.DataFrame(data_list), valid_tickers
+    df = pd.DataFrame({
+        "代號": codes_out,
+        "名稱": names,
+        "日期": dates,
+        "收盤價": closes,
+        "漲跌": changes,
+        "漲跌幅(%)": pcts,
+        "成交量": vols
+    }).round({"收盤價": 2, "漲跌": 2, "漲跌幅(%)": 2}) # 整欄一次四捨五入 (重點關注卡片直接顯示數值)
+    return df, valid_tickers
 
-def get_weekly_trend(valid_tickers):
-    """ 抓取本週一至今的走勢數據 (圖表用 - 僅顯示 09:00 與 13:30) """
+def _fetch_histories(symbols, start, end=None, interval='1d', max_workers=8, timeout=30, on_done=None):
+    """
+    以執行緒池平行抓取多檔股票的歷史資料，回傳 {symbol: DataFrame}
+    - timeout: 整批等待的秒數上限
+    - on_done: 每完成一檔就在主執行緒呼叫 on_done(已完成數, 總數, symbol)，供更新進度條
+    """
+    # 抓取失敗或逾時的股票一律保留空表，由呼叫端當作查無資料處理
+    results = {symbol: pd.DataFrame() for symbol in symbols}
+    ex = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {ex.submit(_cached_history, symbol, start, end, interval): symbol for symbol in symbols}
+    try:
+        for n_done, fut in enumerate(as_completed(futures, timeout=timeout), start=1):
+            symbol = futures[fut]
+            try:
+                results[symbol] = fut.result()
+            except Exception:
+                pass # 任何錯誤 (網路、yfinance 限流、回應格式異常等) 都只跳過這檔股票
+            if on_done:
+                on_done(n_done, len(futures), symbol)
+    except TimeoutError:
+        pass # 超過時間仍未完成的股票維持空表
+    finally:
+        # 不等待卡住的請求，尚未開始的直接取消
+        ex.shutdown(wait=False, cancel_futures=True)
+    return results
+
+def get_price_panel(valid_tickers, start_date):
+    """ 一次抓取所有股票自 start_date 起的日線，回傳欄位為 (Open/Close/Volume, "代號 名稱") 的寬表，供三張走勢圖共用 """
+    symbols = tuple(sorted({symbol for _, symbol, _ in valid_tickers}))
+    try:
+        raw = _cached_panel_download(symbols, start_date)
+    except Exception:
+        return pd.DataFrame()
+    
+    frames = {}
+    for code, symbol, name in valid_tickers:
+        df = _frame_for(raw, symbol)
+        if not df.empty:
+            frames[f"{code} {name}"] = df
     
-    tw = pytz.timezone('Asia/Taipei')
-    today = datetime.now(tw)
+    if not frames:
+        return pd.DataFrame()
+    
+    panel = pd.concat(
+        {field: pd.DataFrame({label: df[field] for label, df in frames.items()})
+         for field in ('Open', 'Close', 'Volume')},
+        axis=1
+    )
+    # 移除時區 (yf.download 的日線有時已是無時區的 index，此時不需轉換)
+    if panel.index.tz is not None:
+        panel.index = panel.index.tz_localize(None)
+    return panel.sort_index()
+
+def get_weekly_trend(panel):
+    """ 本週一至今的走勢數據 (圖表用 - 僅顯示 09:00 與 13:30) """
+    
+    today = datetime.now(TW_TZ)
     monday = today - timedelta(days=today.weekday())
     start_date = monday.strftime('%Y-%m-%d')
     
-    trend_data = pd.DataFrame()
+    if panel.empty:
+        return pd.DataFrame()
+    
+    series_list = []
+    week = panel.loc[start_date:]
     
-    for code, symbol, name in valid_tickers:
+    for label in week['Close'].columns:
         try:
-            stock = yf.Ticker(symbol)
-            df = stock.history(start=start_date, interval='1d')
+            df = pd.DataFrame({'Open': week['Open'][label], 'Close': week['Close'][label]}).dropna()
             
             if not df.empty:
-                points = []
-                for date, row in df.iterrows():
-                    d = date.replace(tzinfo=None)
-                    
-                    # 09:00 開盤
-                    points.append({
-                        'DateTime': d + timedelta(hours=9), 
-                        'Price': row['Open']
-                    })
-                    
-                    # 13:30 收盤
-                    points.append({
-                        'DateTime': d + timedelta(hours=13, minutes=30), 
-                        'Price': row['Close']
-                    })
+                # 每日展開成 09:00 開盤與 13:30 收盤兩個點 (index 已在 get_price_panel 移除時區)
+                open_s = pd.Series(df['Open'].values, index=df.index + pd.Timedelta(hours=9))
+                close_s = pd.Series(df['Close'].values, index=df.index + pd.Timedelta(hours=13, minutes=30))
+                stock_df = pd.concat([open_s, close_s]).sort_index().to_frame('Price')
                 
-                stock_df = pd.DataFrame(points).set_index('DateTime')
-                
-                start_price = stock_df['Price'].iloc[0]
-                stock_df['CumReturn'] = ((stock_df['Price'] - start_price) / start_price) * 100
+                # 以週一開盤為基準的累積漲跌幅
+                stock_df['CumReturn'] = stock_df['Price'].div(stock_df['Price'].iloc[0]).sub(1).mul(100)
                 
                 series = stock_df['CumReturn']
-                series.name = f"{code} {name}"
-                
-                if trend_data.empty:
-                    trend_data = pd.DataFrame(series)
-                else:
-                    trend_data = trend_data.join(series, how='outer')
+                series.name = label
+                series_list.append(series)
         except Exception:
             pass
     
+    # 迴圈結束後一次合併，避免每檔股票都重新配置整張表
+    trend_data = pd.concat(series_list, axis=1, join='outer') if series_list else pd.DataFrame()
+    
     # 格式化 X 軸
     if not trend_data.empty:
         trend_data = trend_data.sort_index()
-        weekdays_map = {0: '週一', 1: '週二', 2: '週三', 3: '週四', 4: '週五', 5: '週六', 6: '週日'}
+        idx = trend_data.index
+        weekdays = np.array(WEEKDAYS)[idx.weekday.values]
         
-        new_index = []
-        for dt in trend_data.index:
-            wd = weekdays_map[dt.weekday()]
-            hm = dt.strftime("%H:%M")
-            md = f"{dt.month}月{dt.day}號"
-            new_index.append(f"{md} {wd} {hm}")
-            
-        trend_data.index = new_index
+        # 整個 DatetimeIndex 一次組出 "12月8號 週一 09:00" 格式的標籤
+        trend_data.index = (idx.month.astype(str) + '月' + idx.day.astype(str) + '號 '
+                            + weekdays + ' ' + idx.strftime("%H:%M"))
         
     return trend_data
 
-def get_monthly_trend(valid_tickers):
-    """ 抓取本月1號至今的走勢數據 (圖表用 - 每日收盤 13:30) """
+def get_monthly_trend(panel):
+    """ 本月1號至今的走勢數據 (圖表用 - 每日收盤 13:30) """
     
-    tw = pytz.timezone('Asia/Taipei')
-    today = datetime.now(tw)
+    today = datetime.now(TW_TZ)
     # 取得本月1號的日期
     start_date = today.replace(day=1).strftime('%Y-%m-%d')
     
-    trend_data = pd.DataFrame()
+    if panel.empty:
+        return pd.DataFrame()
     
-    for code, symbol, name in valid_tickers:
+    series_list = []
+    # 日線的 Close 就是當日 13:30 收盤價 (時區已在 get_price_panel 移除)
+    month = panel.loc[start_date:, 'Close']
+    
+    for label in month.columns:
         try:
-            stock = yf.Ticker(symbol)
-            # 抓取日線 (日線的 Close 就是當日 13:30 收盤價)
-            df = stock.history(start=start_date, interval='1d')
+            close = month[label].dropna()
             
-            if not df.empty:
-                # 處理時區，確保可以合併
-                df.index = df.index.map(lambda x: x.replace(tzinfo=None))
-                
+            if not close.empty:
                 # 計算相對於本月第一天收盤的漲跌幅
-                start_price = df['Close'].iloc[0]
+                start_price = close.iloc[0]
                 # 避免除以零
                 if start_price > 0:
-                    series = ((df['Close'] - start_price) / start_price) * 100
-                    series.name = f"{code} {name}"
-                    
-                    if trend_data.empty:
-                        trend_data = pd.DataFrame(series)
-                    else:
-                        trend_data = trend_data.join(series, how='outer')
+                    series = ((close - start_price) / start_price) * 100
+                    series.name = label
+                    series_list.append(series)
         except Exception:
             pass
+    
+    trend_data = pd.concat(series_list, axis=1, join='outer') if series_list else pd.DataFrame()
             
     # 格式化 X 軸 (只顯示日期 MM/DD)
     if not trend_data.empty:
         trend_data = trend_data.sort_index()
-        new_index = [dt.strftime("%m/%d") for dt in trend_data.index]
-        trend_data.index = new_index
+        trend_data.index = trend_data.index.strftime("%m/%d")
         
     return trend_data
 
 # <--- 修正: 今年每月走勢比較 (導入自動校正與過濾機制) --->
-def get_yearly_trend(valid_tickers):
-    """ 抓取今年每月第一天與最後一天的收盤數據 """
+def get_yearly_trend(panel):
+    """ 今年每月第一天與最後一天的收盤數據 """
     
-    tw = pytz.timezone('Asia/Taipei')
-    now = datetime.now(tw)
+    now = datetime.now(TW_TZ)
     current_year = now.year
     start_date = f"{current_year}-01-01"
     
-    # 1. 先收集所有股票的原始資料
-    all_series = {}
+    if panel.empty:
+        return pd.DataFrame()
     
-    for code, symbol, name in valid_tickers:
-        try:
-            stock = yf.Ticker(symbol)
-            df = stock.history(start=start_date, interval='1d')
-            if not df.empty:
-                df.index = df.index.tz_localize(None) # 移除時區
-                df = df[df['Volume'] > 0] # 基本過濾成交量0
-                
-                # 時間守門員: 移除今日盤中資料
-                last_date = df.index[-1].date()
-                if last_date == now.date() and now.strftime('%H:%M') < '13:30':
-                    df = df.iloc[:-1]
-                
-                if not df.empty:
-                     # 存入收盤價，Key為 "股票代號 名稱"
-                     all_series[f"{code} {name}"] = df['Close']
-        except Exception:
-            pass
-
-    if not all_series:
+    # 1. 從共用寬表取出所有股票今年的收盤價 (Date x Stocks)，整張表一次過濾
+    year = panel.loc[start_date:]
+    close = year['Close'].where(year['Volume'] > 0) # 基本過濾成交量0
+    
+    # 時間守門員: 移除今日盤中資料
+    if not close.empty and close.index[-1].date() == now.date() and now.strftime('%H:%M') < '13:30':
+        close = close.iloc[:-1]
+    
+    # 去掉整天都沒有股票有資料的日期，以及今年完全沒有資料的股票
+    combined_df = close.dropna(how='all').dropna(axis=1, how='all')
+    if combined_df.empty:
         return pd.DataFrame()
 
-    # 2. 合併成一個大表 (Date x Stocks)
-    # 使用 outer join 保留所有日期，然後用 ffill 填補缺漏 (處理12/8缺12/9的情況)
-    combined_df = pd.DataFrame(all_series)
-    combined_df = combined_df.sort_index()
-    combined_df = combined_df.ffill() # 關鍵: 若某股缺了最新收盤日，沿用昨日收盤價
+    # 2. 用 ffill 填補缺漏 (處理12/8缺12/9的情況)
+    # 關鍵: 若某股缺了最新收盤日，沿用昨日收盤價 (最多補一天，避免長期停牌時一路沿用舊價)
+    combined_df.ffill(limit=1, inplace=True)
 
     # 3. 過濾無效交易日 (解決 8/1 幽靈資料)
     # 邏輯: 每一天必須有超過一半的股票有資料，才算是有效開盤日
@@ -270,52 +351,40 @@ def get_yearly_trend(valid_tickers):
     # 這裡採用簡化法：直接使用合併後的 Index，因為 yfinance 通常大部分股票日期是一致的。
     # 如果 8/1 只有一支股票有，其他都是 NaN。
     # 我們計算每個 Row 的非 NaN 數量
-    valid_counts = combined_df.notna().sum(axis=1)
-    threshold = len(valid_tickers) * 0.3 # 門檻: 至少30%股票有值
-    combined_df = combined_df[valid_counts >= threshold]
+    # 門檻: 至少30%股票有值 (dropna 的 thresh 需為整數，無條件進位與原本的 >= 比較相同)
+    combined_df = combined_df.dropna(axis=0, thresh=math.ceil(0.3 * len(year['Close'].columns)))
 
     # 4. 找出每個月的「第一天」與「最後一天」 (基於過濾後的有效日期)
-    combined_df['Month'] = combined_df.index.month
-    target_dates = []
-    
-    for month, group in combined_df.groupby('Month'):
-        if not group.empty:
-            target_dates.append(group.index[0]) # 該月第一天
-            if group.index[-1] != group.index[0]:
-                target_dates.append(group.index[-1]) # 該月最後一天
+    by_month = combined_df.groupby(pd.Grouper(freq='MS'))
+    first_rows = by_month.head(1) # 該月第一天
+    last_rows = by_month.tail(1) # 該月最後一天
 
-    # 5. 只保留這些目標日期的資料
-    final_df = combined_df.loc[target_dates].copy()
-    
-    # 移除 Month 欄位，準備計算漲跌幅
-    if 'Month' in final_df.columns:
-        del final_df['Month']
+    # 5. 只保留這些目標日期的資料 (當月只有一天時首尾是同一列，去除重複日期)
+    final_df = pd.concat([first_rows, last_rows]).sort_index()
+    final_df = final_df[~final_df.index.duplicated()]
+
+    if final_df.empty:
+        return pd.DataFrame()
 
     # 6. 計算 YTD 漲跌幅
-    trend_data = pd.DataFrame()
-    for col in final_df.columns:
-        # 找到該股票今年的第一個有效價格 (基期)
-        # 注意: 有些股票可能年中才上市，基期不一定是 1/2
-        first_valid_idx = final_df[col].first_valid_index()
-        if first_valid_idx is not None:
-            start_price = final_df.loc[first_valid_idx, col]
-            if start_price > 0:
-                trend_data[col] = ((final_df[col] - start_price) / start_price) * 100
+    # 每檔股票今年的第一個有效價格 (基期): 往回填補後的第一列即為各欄第一個非 NaN 值
+    # 注意: 有些股票可能年中才上市，基期不一定是 1/2
+    base = final_df.bfill().iloc[0]
+    valid = base > 0 # 全為 NaN 或基期非正數的股票不計算
+    trend_data = final_df.loc[:, valid].div(base[valid]).sub(1).mul(100)
     
     # 7. 格式化 X 軸
     if not trend_data.empty:
-        new_index = [dt.strftime("%m/%d") for dt in trend_data.index]
-        trend_data.index = new_index
+        trend_data.index = trend_data.index.strftime("%m/%d")
 
     return trend_data
 # <--- 修正結束 --->
 
-def get_history_by_date(stock_list, target_date):
-    """ 查詢特定日期的股價資料 """
+def get_history_by_date(stock_list, target_date, max_workers=8):
+    """ 查詢特定日期的股價資料，stock_list 需為已去除空白的代號清單 """
     
     # <--- 新增: 時間檢核邏輯 (台灣時間) --->
-    tw = pytz.timezone('Asia/Taipei')
-    now = datetime.now(tw)
+    now = datetime.now(TW_TZ)
     
     # 1. 如果查詢日期是「今天」，且現在時間早於 13:30，表示尚未收盤
     # 我們不應該顯示資料，以免使用者誤以為盤中價格是收盤價
@@ -334,29 +403,32 @@ def get_history_by_date(stock_list, target_date):
     
     progress_bar = st.progress(0)
     status_text = st.empty()
+    
     total = len(stock_list)
+    status_text.text(f"正在查詢: {', '.join(stock_list)} ...")
     
-    for i, code in enumerate(stock_list):
-        code = code.strip()
-        if not code: continue
-        
+    # 進度條跟著網路抓取前進 (批次更新，避免每檔股票都往返瀏覽器)
+    step = max(1, total // 20)
+    def update_progress(n_done, n_total, symbol):
+        if n_done % step == 0 or n_done == n_total:
+            progress_bar.progress(n_done / n_total)
+            status_text.text(f"正在查詢: {symbol.split('.')[0]} ({n_done}/{n_total})")
+    
+    # 平行抓取該日資料
+    histories = _fetch_histories([f"{code}.TW" for code in stock_list], target_date.strftime('%Y-%m-%d'),
+                                 end=next_day.strftime('%Y-%m-%d'), max_workers=max_workers,
+                                 on_done=update_progress)
+    
+    for code in stock_list:
         ticker_symbol = f"{code}.TW"
-        status_text.text(f"正在查詢: {code} ...")
         
         try:
-            stock = yf.Ticker(ticker_symbol)
-            # 抓取該日資料
-            hist = stock.history(start=target_date, end=next_day)
+            hist = histories[ticker_symbol]
             
             if not hist.empty:
                 row = hist.iloc[0]
                 
-                # 名稱邏輯 (複製上方邏輯)
-                name = stock.info.get('longName', code)
-                if code in MANUAL_STOCK_NAMES:
-                    name = MANUAL_STOCK_NAMES[code]
-                elif twstock and code in twstock.codes:
-                    name = twstock.codes[code].name
+                name = resolve_name(code)
                 
                 data_list.append({
                     "代號": code,
@@ -373,8 +445,6 @@ def get_history_by_date(stock_list, target_date):
         except Exception:
             pass
         
-        progress_bar.progress((i + 1) / total)
-        
     status_text.empty()
     progress_bar.empty()
     
@@ -394,11 +464,11 @@ def plot_custom_chart(df):
     # 轉換為 Long Format (長表格)，這是 Altair 喜歡的格式
     df_long = df.melt(id_vars=[date_col], var_name='股票', value_name='漲跌幅')
     
-    # 建立一個專門顯示用的欄位 (將數值轉為 "1.23%" 字串)
-    df_long['漲跌幅顯示'] = df_long['漲跌幅'].apply(lambda x: f"{x:.2f}%" if pd.notnull(x) else "")
-    
     # 建立圖表
-    chart = alt.Chart(df_long).mark_line(point=True).encode(
+    chart = alt.Chart(df_long).mark_line(point=True).transform_calculate(
+        # 建立一個專門顯示用的欄位 (將數值轉為 "1.23%" 字串)，交給瀏覽器端的 Vega 計算，NaN 留空
+        漲跌幅顯示="isValid(datum['漲跌幅']) ? format(datum['漲跌幅'], '.2f') + '%' : ''"
+    ).encode(
         # X 軸: 使用日期欄位，並設定 sort=None 確保照原本順序排列
         x=alt.X(date_col, title='日期', sort=None),
         # Y 軸: 設定標題
@@ -409,7 +479,7 @@ def plot_custom_chart(df):
         tooltip=[
             alt.Tooltip(date_col, title='日期'),
             alt.Tooltip('股票', title='股票'),
-            alt.Tooltip('漲跌幅顯示', title='漲跌幅') # 使用格式化後的欄位
+            alt.Tooltip('漲跌幅顯示:N', title='漲跌幅') # 使用格式化後的欄位
         ]
     ).interactive() # 允許縮放和平移
     
@@ -417,9 +487,9 @@ def plot_custom_chart(df):
     st.altair_chart(chart, use_container_width=True)
 # <--- 結束 --->
 
-def color_change(val):
-    color = 'red' if val > 0 else 'green' if val < 0 else 'black'
-    return f'color: {color}'
+def color_change(col):
+    """ 整欄一次決定顏色: 漲紅、跌綠、平盤黑 (供 Styler.apply 使用) """
+    return np.where(col > 0, 'color: red', np.where(col < 0, 'color: green', 'color: black'))
 
 # --- 主程式 ---
 
@@ -448,6 +518,7 @@ else:
 
 default_stocks = "006208, 2317, 2353, 00893"
 user_input = st.sidebar.text_area("輸入股票代號 (逗號分隔):", value=default_stocks, height=150)
+# 代號只在這裡清理一次，之後的函數都直接使用
 stock_codes = [x.strip() for x in user_input.split(',') if x.strip()]
 
 # Session State 初始化
@@ -463,8 +534,7 @@ if st.sidebar.button("更新股價", type="primary"):
     if not stock_codes:
         st.warning("請輸入代號")
     else:
-        tw = pytz.timezone('Asia/Taipei')
-        current_time = datetime.now(tw).strftime('%Y-%m-%d %H:%M:%S')
+        current_time = datetime.now(TW_TZ).strftime('%Y-%m-%d %H:%M:%S')
         
         df, valid_tickers = get_stock_data(stock_codes)
         
@@ -493,7 +563,7 @@ if not st.session_state.stock_data.empty:
 
     # 詳細清單
     st.subheader("詳細清單")
-    styled_df = df.style.applymap(color_change, subset=['漲跌', '漲跌幅(%)']) \
+    styled_df = df.style.apply(color_change, subset=['漲跌', '漲跌幅(%)']) \
                         .format("{:.2f}", subset=['收盤價', '漲跌', '漲跌幅(%)']) \
                         .format("{:,}", subset=['成交量']) 
     
@@ -513,8 +583,15 @@ if not st.session_state.stock_data.empty:
     st.subheader("📊 本週走勢比較 (每日 09:00 與 13:30)")
     st.caption("顯示每日開盤與收盤的變化趨勢，以週一開盤為基準 (0%)")
     
+    # 三張走勢圖共用同一份日線資料: 從「今年1月1日」與「本週一」較早者開始抓一次
+    today = datetime.now(TW_TZ).date()
+    monday = today - timedelta(days=today.weekday())
+    panel_start = min(today.replace(month=1, day=1), monday).strftime('%Y-%m-%d')
+    with st.spinner('正在抓取走勢資料...'):
+        price_panel = get_price_panel(valid_tickers, panel_start)
+    
     with st.spinner('正在繪製本週走勢圖...'):
-        chart_data = get_weekly_trend(valid_tickers)
+        chart_data = get_weekly_trend(price_panel)
         if not chart_data.empty:
             plot_custom_chart(chart_data)
         else:
@@ -526,7 +603,7 @@ if not st.session_state.stock_data.empty:
     st.caption("顯示本月1號至今的收盤價漲跌幅 (%)，X軸僅顯示日期")
     
     with st.spinner('正在繪製本月走勢圖...'):
-        month_chart_data = get_monthly_trend(valid_tickers)
+        month_chart_data = get_monthly_trend(price_panel)
         if not month_chart_data.empty:
             plot_custom_chart(month_chart_data)
         else:
@@ -538,7 +615,7 @@ if not st.session_state.stock_data.empty:
     st.caption("抓取今年每個月的「第一天」與「最後一天」收盤價，觀察長期月線趨勢 (0% 為今年年初基準)")
     
     with st.spinner('正在繪製年線趨勢圖...'):
-        yearly_chart_data = get_yearly_trend(valid_tickers)
+        yearly_chart_data = get_yearly_trend(price_panel)
         if not yearly_chart_data.empty:
             plot_custom_chart(yearly_chart_data)
         else:
@@ -556,8 +633,7 @@ st.caption("選擇特定日期，查詢上方設定清單中的股價資訊 (顯
 col1, col2 = st.columns([1, 4])
 with col1:
     # 日期選擇器: 預設為今天
-    tw = pytz.timezone('Asia/Taipei')
-    search_date = st.date_input("請選擇日期", value=datetime.now(tw).date())
+    search_date = st.date_input("請選擇日期", value=datetime.now(TW_TZ).date())
 
 with col2:
     st.write("") # 排版用空白 (讓按鈕對齊輸入框)